@@ -1,9 +1,8 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import shap
-import io
+import base64
+
+from shap_kernels import calculate_shap_values
 
 # 页面配置 - 使用centered布局但通过CSS让内容居中
 st.set_page_config(
@@ -13,12 +12,8 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# 设置中文字体
-plt.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS', 'DejaVu Sans']
-plt.rcParams['axes.unicode_minus'] = False
-
 # 自定义CSS样式 - 让所有内容居中
-st.markdown("""
+APP_CSS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -120,111 +115,115 @@ st.markdown("""
         padding: 0 !important;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
 
-def calculate_shap_values(sample_data):
-    """Calculate SHAP values"""
-    
-    # Feature display name mapping
-    feature_display_names = {
-        'FTSST': 'FTSST',
-        'Complications': 'Complications',
-        'fall': 'History of falls',
-        'bl_crp': 'CRP',
-        'PA': 'PA',
-        'bl_hgb': 'HGB',
-        'smoke': 'Smoke',
-        'gender': 'Gender',
-        'age': 'Age',
-        'bmi': 'BMI',
-        'ADL': 'ADL'
-    }
-    
-    features = list(sample_data.keys())
-    feature_names = [feature_display_names[f] for f in features]
-    
-    # Initialize SHAP values - based on clinical significance
-    shap_values = np.zeros(len(features))
-    
-    # Assign SHAP contributions for each feature (based on clinical importance)
-    # Positive predictive variables - positive values increase risk
-    shap_values[features.index('age')] = 0.08 * (sample_data['age'] / 71)
-    shap_values[features.index('FTSST')] = 0.06 * sample_data['FTSST']
-    shap_values[features.index('bmi')] = 0.05 * (sample_data['bmi'] / 26)
-    shap_values[features.index('Complications')] = 0.04 * sample_data['Complications']
-    shap_values[features.index('fall')] = 0.03 * sample_data['fall']
-    shap_values[features.index('ADL')] = 0.02 * sample_data['ADL']
-    shap_values[features.index('bl_crp')] = 0.01 * (sample_data['bl_crp'] / 9)
-    shap_values[features.index('gender')] = 0.04 * sample_data['gender']
-    
-    # Negative predictive variables - negative values decrease risk
-    shap_values[features.index('PA')] = -0.02 * (2 - sample_data['PA'])
-    shap_values[features.index('smoke')] = -0.03 * (1 - sample_data['smoke'])
-    shap_values[features.index('bl_hgb')] = -0.01
-    
-    # Set base value and current prediction value
-    base_value = 0.35
-    current_value = base_value + shap_values.sum()
-    current_value = max(0.01, min(0.99, current_value))
-    
-    return base_value, current_value, shap_values, feature_names, features
+# Footer instructions
+FOOTER_HTML = """
+<div class="footer">
+    <p>💡 <strong>Instructions for use:</strong> After filling in all evaluation indicators, click the "Predict" button to obtain personalized frailty risk assessment results</p>
+    <p>© 2025 KOA Prediction System | For clinical reference only</p>
+</div>
+"""
 
-def create_shap_force_plot(base_value, shap_values, sample_data):
-    """Create SHAP force analysis diagram"""
-    
-    # Feature display name mapping
-    feature_display_names = {
-        'FTSST': 'FTSST',
-        'Complications': 'Complications',
-        'fall': 'History of falls',
-        'bl_crp': 'CRP',
-        'PA': 'PA',
-        'bl_hgb': 'HGB',
-        'smoke': 'Smoke',
-        'gender': 'Gender',
-        'age': 'Age',
-        'bmi': 'BMI',
-        'ADL': 'ADL'
-    }
-    
-    features = list(sample_data.keys())
-    
-    # Create feature display names (including values)
-    feature_display = []
-    for feat in features:
-        display_name = feature_display_names[feat]
-        value = sample_data[feat]
-        feature_display.append(f"{display_name} = {value}")
-    
-    # Create figure
-    plt.figure(figsize=(14, 6))
-    
-    # Create SHAP force plot
-    shap.force_plot(
-        base_value,
-        shap_values,
-        feature_names=feature_display,
-        matplotlib=True,
-        show=False,
-        plot_cmap=['#FF0D57', '#1E88E5']  # Red = increases risk, Blue = decreases risk
-    )
-    
-    plt.title("SHAP Force Plot for Individual Prediction", 
-              fontsize=16, fontweight='bold', pad=20)
-    plt.tight_layout()
-    
-    # Convert matplotlib figure to image for display in Streamlit
+# Streamlit drops any element a rerun does not emit again, so the styles must be
+# injected on every run rather than guarded by a once-per-session flag
+st.markdown(APP_CSS, unsafe_allow_html=True)
+
+# Model input features, in the order the SHAP values are reported
+FEATURE_ORDER = ('FTSST', 'Complications', 'fall', 'bl_crp', 'PA', 'bl_hgb',
+                 'smoke', 'gender', 'age', 'bmi', 'ADL')
+
+# Feature display names, aligned with FEATURE_ORDER
+FEATURE_DISPLAY_NAMES = ('FTSST', 'Complications', 'History of falls', 'CRP', 'PA', 'HGB',
+                         'Smoke', 'Gender', 'Age', 'BMI', 'ADL')
+
+@st.cache_resource
+def _init_matplotlib():
+    """Configure matplotlib once per server process; first called at startup by _warm_fonts()"""
+    import matplotlib
+    # 设置中文字体
+    matplotlib.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS', 'DejaVu Sans']
+    matplotlib.rcParams['axes.unicode_minus'] = False
+    return True
+
+@st.cache_resource
+def _warm_fonts():
+    """Resolve the plot fonts once per server process so the first plot skips the font scan"""
+    from matplotlib import font_manager
+    _init_matplotlib()
+    # A bare 'sans-serif' string would be parsed as a fontconfig pattern, so pass a list
+    font_manager.findfont(font_manager.FontProperties(family=['sans-serif']))
+    font_manager.findfont('DejaVu Sans')
+    return True
+
+def _draw_force_plot(ax, base_value, shap_values, sample):
+    """Draw an additive force plot: red segments increase risk, blue segments decrease it"""
+    
+    out_value = base_value + shap_values.sum()
+    widths = np.abs(shap_values)
+    lefts = np.full_like(widths, out_value)
+    colors = np.where(shap_values > 0, '#FF0D57', '#1E88E5')
+    min_width = 0.05 * widths.sum()  # only label segments wide enough to read
+    order = np.argsort(-widths)
+    
+    # Positive contributions stack leftwards from the prediction and negative ones
+    # rightwards, with the largest contribution closest to the prediction
+    pos = order[shap_values[order] > 0]
+    neg = order[shap_values[order] < 0]
+    lefts[pos] = out_value - np.cumsum(widths[pos])
+    lefts[neg] = out_value + np.cumsum(widths[neg]) - widths[neg]
+    
+    for group in (pos, neg):
+        for k, i in enumerate(group[widths[group] >= min_width]):
+            # Feature display name (including value), formatted only for labelled segments;
+            # neighbouring labels are staggered so they do not overlap
+            ax.text(lefts[i] + widths[i] / 2, -0.3 - 0.25 * (k % 2),
+                    f"{FEATURE_DISPLAY_NAMES[i]} = {sample[i]:g}",
+                    ha='center', va='top', fontsize=10, color=colors[i])
+    
+    # Draw every segment in one barh call rather than one call per feature
+    ax.barh(np.zeros(len(widths)), widths, left=lefts, height=0.4, color=colors, edgecolor='white')
+    
+    ax.axvline(base_value, color='gray', linestyle='--', linewidth=1)
+    ax.text(base_value, 0.6, f"base value = {base_value:.2f}", ha='center', va='bottom',
+            fontsize=10, color='gray')
+    ax.text(out_value, 0.3, f"f(x) = {out_value:.2f}", ha='center', va='bottom',
+            fontsize=12, fontweight='bold')
+    
+    ax.set_ylim(-1.0, 0.9)
+    ax.set_yticks([])
+    for side in ('left', 'right', 'top'):
+        ax.spines[side].set_visible(False)
+
+def create_shap_force_plot(base_value, shap_values, sample):
+    """Create SHAP force analysis diagram as PNG bytes"""
+    
+    # Plot-only imports; matplotlib itself is already loaded by _warm_fonts()
+    import io
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    _init_matplotlib()
+    
+    # Create SHAP force plot on a bare Agg canvas: no pyplot figure manager to
+    # register or close, and no shared pyplot state between session threads
+    fig = Figure(figsize=(14, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    _draw_force_plot(ax, base_value, shap_values, sample)
+    
+    ax.set_title("SHAP Force Plot for Individual Prediction", 
+                 fontsize=16, fontweight='bold', pad=20)
+    fig.tight_layout()
+    
+    # Convert matplotlib figure to image for display in Streamlit; the image is
+    # scaled to the container width, so 110 dpi is plenty for on-screen display
     buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=300, bbox_inches='tight')
-    buf.seek(0)
-    plt.close()
+    fig.savefig(buf, format='png', dpi=110)
     
-    return buf
+    return buf.getvalue()
 
-def get_risk_recommendation(probability):
-    """Provide recommendations based on probability value"""
-    if probability > 0.7:
-        return "high", """
+# Risk level and recommendation text for each probability band
+_HIGH_RISK = ("high", """
         ⚠️ High risk: immediate clinical intervention recommended
         
         • Weekly follow-up monitoring
@@ -232,9 +231,8 @@ def get_risk_recommendation(probability):
         • Comprehensive assessment of complications
         • Multidisciplinary team management
         • Emergency nutritional support
-        """
-    elif probability > 0.45:
-        return "medium", """
+        """)
+_MEDIUM_RISK = ("medium", """
         ⚠️ Medium risk: It is recommended to regularly monitor
         
         • Assess every 3-6 months
@@ -242,9 +240,8 @@ def get_risk_recommendation(probability):
         • Basic Nutritional Assessment
         • Fall prevention education
         • Regular functional assessment
-        """
-    else:
-        return "low", """
+        """)
+_LOW_RISK = ("low", """
         ✅ Low risk: Recommended for routine health management
         
         • Annual physical examination
@@ -252,7 +249,37 @@ def get_risk_recommendation(probability):
         • Preventive Health Guidance
         • Moderate physical activity
         • Balanced nutritional intake
-        """
+        """)
+
+# Recommendation block markup for each risk level, built once
+RISK_HTML = {level: f'<div class="{level}-risk">{text}'
+             for level, text in (_HIGH_RISK, _MEDIUM_RISK, _LOW_RISK)}
+
+def get_risk_recommendation(probability):
+    """Provide recommendations based on probability value"""
+    if probability > 0.7:
+        return _HIGH_RISK
+    elif probability > 0.45:
+        return _MEDIUM_RISK
+    else:
+        return _LOW_RISK
+
+# Bounded: each entry holds a ~40 KB base64 PNG and the sliders allow millions of distinct inputs
+@st.cache_data(show_spinner=False, max_entries=256, ttl=3600)
+def predict(sample_values):
+    """Score a sample and render its force plot; returns (probability, risk level, base64 PNG)"""
+    
+    # A repeat submission with the same inputs is a single cache lookup on this tuple
+    sample = np.array(sample_values, dtype=np.float32)
+    
+    base_val, current_val, shap_vals = calculate_shap_values(sample)
+    risk_level, _ = get_risk_recommendation(current_val)
+    shap_image = create_shap_force_plot(base_val, shap_vals, sample)
+    
+    return current_val, risk_level, base64.b64encode(shap_image).decode()
+
+# Load the font cache at startup rather than on the first Predict click
+_warm_fonts()
 
 # Application title - 标题放在一行
 st.markdown('<h1 class="main-header">🩺 Frailty Risk Prediction System for Patients with Knee Osteoarthritis</h1>', unsafe_allow_html=True)
@@ -264,91 +291,77 @@ Based on the input clinical features, predict the probability of frailty in pati
 </div>
 """, unsafe_allow_html=True)
 
-# Form container - centered
-st.markdown('<div class="form-container">', unsafe_allow_html=True)
-
-# Assessment form - all questions in one column
-with st.form("assessment_form"):
-    
-    # All features in one column - use default values or minimum values
-    age = st.slider("Age", 40, 110, 40)
-    
-    gender = st.selectbox("Gender", [0, 1], format_func=lambda x: "Male" if x == 0 else "Female", index=0)
-    
-    bmi = st.slider("BMI", 15.0, 40.0, 18.5, 0.1)
-    
-    smoke = st.selectbox("Smoke", [0, 1], format_func=lambda x: "No" if x == 0 else "Yes", index=0)
-    
-    ftsst = st.selectbox("FTSST (5 Times Sit-to-Stand Test)", [0, 1], 
-                       format_func=lambda x: "≤12s" if x == 0 else ">12s", index=0)
-    
-    adl = st.selectbox("ADL (Activities of Daily Living)", [0, 1], 
-                     format_func=lambda x: "Unrestricted" if x == 0 else "Restricted", index=0)
-    
-    pa = st.selectbox("Physical Activity Level", [0, 1, 2], 
-                    format_func=lambda x: ["High", "Medium", "Low"][x], index=0)
-    
-    complications = st.selectbox("Number of Complications", [0, 1, 2], 
-                               format_func=lambda x: ["No", "One", "≥2"][x], index=0)
-    
-    fall = st.selectbox("History of falls", [0, 1], format_func=lambda x: "No" if x == 0 else "Yes", index=0)
-    
-    bl_crp = st.slider("C-reactive protein, CRP (mg/L)", 0.0, 30.0, 0.0, 0.1)
+@st.fragment
+def assessment_section():
+    """Assessment form and prediction results; reruns on its own without the page scaffold"""
     
-    bl_hgb = st.slider("Hemoglobin, HGB (g/L)", 50.0, 250.0, 120.0, 1.0)
-    
-    # Prediction button
-    submit_button = st.form_submit_button("🚀 Predict")
+    # Form container - centered
+    st.markdown('<div class="form-container">', unsafe_allow_html=True)
 
-st.markdown('</div>', unsafe_allow_html=True)
+    # Assessment form - all questions in one column
+    # Explicit keys (named after FEATURE_ORDER) keep widget identity stable across reruns
+    with st.form("assessment_form", clear_on_submit=False):
+        
+        # All features in one column - use default values or minimum values
+        age = st.slider("Age", 40, 110, 40, key="age")
+        
+        gender = st.selectbox("Gender", [0, 1], format_func=lambda x: "Male" if x == 0 else "Female", index=0, key="gender")
+        
+        bmi = st.slider("BMI", 15.0, 40.0, 18.5, 0.1, key="bmi")
+        
+        smoke = st.selectbox("Smoke", [0, 1], format_func=lambda x: "No" if x == 0 else "Yes", index=0, key="smoke")
+        
+        ftsst = st.selectbox("FTSST (5 Times Sit-to-Stand Test)", [0, 1], 
+                           format_func=lambda x: "≤12s" if x == 0 else ">12s", index=0, key="FTSST")
+        
+        adl = st.selectbox("ADL (Activities of Daily Living)", [0, 1], 
+                         format_func=lambda x: "Unrestricted" if x == 0 else "Restricted", index=0, key="ADL")
+        
+        pa = st.selectbox("Physical Activity Level", [0, 1, 2], 
+                        format_func=lambda x: ["High", "Medium", "Low"][x], index=0, key="PA")
+        
+        complications = st.selectbox("Number of Complications", [0, 1, 2], 
+                                   format_func=lambda x: ["No", "One", "≥2"][x], index=0, key="Complications")
+        
+        fall = st.selectbox("History of falls", [0, 1], format_func=lambda x: "No" if x == 0 else "Yes", index=0, key="fall")
+        
+        bl_crp = st.slider("C-reactive protein, CRP (mg/L)", 0.0, 30.0, 0.0, 0.1, key="bl_crp")
+        
+        bl_hgb = st.slider("Hemoglobin, HGB (g/L)", 50.0, 250.0, 120.0, 1.0, key="bl_hgb")
+        
+        # Prediction button
+        submit_button = st.form_submit_button("🚀 Predict")
 
-# Process prediction results
-if submit_button:
-    # Create sample data
-    sample_data = {
-        'FTSST': ftsst,
-        'Complications': complications,
-        'fall': fall,
-        'bl_crp': float(bl_crp),
-        'PA': pa,
-        'bl_hgb': float(bl_hgb),
-        'smoke': smoke,
-        'gender': gender,
-        'age': age,
-        'bmi': float(bmi),
-        'ADL': adl
-    }
-    
-    # Calculate SHAP values
-    base_val, current_val, shap_vals, feature_names, features = calculate_shap_values(sample_data)
-    
-    # Display prediction results - centered
-    st.markdown("---")
-    
-    # Prediction result
-    st.markdown(f"### 📊 Prediction result: The probability of patient frailty is **{current_val:.1%}**")
-    
-    # Provide recommendations based on probability
-    risk_level, recommendation = get_risk_recommendation(current_val)
-    
-    if risk_level == "high":
-        st.markdown(f'<div class="high-risk">{recommendation}', unsafe_allow_html=True)
-    elif risk_level == "medium":
-        st.markdown(f'<div class="medium-risk">{recommendation}', unsafe_allow_html=True)
-    else:
-        st.markdown(f'<div class="low-risk">{recommendation}', unsafe_allow_html=True)
-    
-    # SHAP diagram - centered
-    st.markdown("### 📈 SHAP force analysis diagram")
-    st.markdown('<div class="shap-container">', unsafe_allow_html=True)
-    shap_image = create_shap_force_plot(base_val, shap_vals, sample_data)
-    st.image(shap_image, use_container_width=True)
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    # Process prediction results
+    if submit_button:
+        # Create sample data, ordered as FEATURE_ORDER
+        sample_values = (ftsst, complications, fall, bl_crp, pa, bl_hgb,
+                         smoke, gender, age, bmi, adl)
+        
+        # Keep the last result so reruns that do not resubmit redisplay it without recomputing
+        st.session_state['last_result'] = predict(sample_values)
+
+    if 'last_result' in st.session_state:
+        current_val, risk_level, shap_b64 = st.session_state['last_result']
+        
+        # Display prediction results - centered
+        st.markdown("---")
+        
+        # Prediction result
+        st.markdown(f"### 📊 Prediction result: The probability of patient frailty is **{current_val:.1%}**")
+        
+        st.markdown(RISK_HTML[risk_level], unsafe_allow_html=True)
+        
+        # SHAP diagram - centered
+        st.markdown("### 📈 SHAP force analysis diagram")
+        # Inline the PNG so the plot is a single delta with no media file registration
+        st.markdown(f'<div class="shap-container"><img src="data:image/png;base64,{shap_b64}" style="width:100%"/></div>',
+                    unsafe_allow_html=True)
+
+assessment_section()
 
 # Footer instructions
 st.markdown("---")
-st.markdown("""
-<div class="footer">
-    <p>💡 <strong>Instructions for use:</strong> After filling in all evaluation indicators, click the "Predict" button to obtain personalized frailty risk assessment results</p>
-    <p>© 2025 KOA Prediction System | For clinical reference only</p>
-</div>
-""", unsafe_allow_html=True)
+st.markdown(FOOTER_HTML, unsafe_allow_html=True)
@@ -0,0 +1,81 @@
+"""Numba SHAP scoring kernels for app.py
+
+Kept in an importable module rather than the Streamlit script: numba can only
+reload its on-disk cache for functions whose module is importable by name, and
+Streamlit does not re-execute imported modules on rerun.
+"""
+import threading
+
+import numpy as np
+from numba import njit, prange
+
+# Linear SHAP contributions per feature, aligned with app.FEATURE_ORDER (based on clinical importance).
+# CRP, age and BMI are normalised by 9, 71 and 26, folded into their coefficients.
+# PA and smoke are protective: -0.02 * (2 - PA) and -0.03 * (1 - smoke) are folded
+# into coefficient + bias form; HGB contributes a constant -0.01.
+# Kept in float32: the results are only ever displayed rounded.
+SHAP_COEFFS = np.array([0.06, 0.04, 0.03, 0.01 / 9, 0.02, 0.0, 0.03, 0.04, 0.08 / 71, 0.05 / 26, 0.02],
+                       dtype=np.float32)
+SHAP_BIAS = np.array([0.0, 0.0, 0.0, 0.0, -0.04, -0.01, -0.03, 0.0, 0.0, 0.0, 0.0], dtype=np.float32)
+SHAP_BASE_VALUE = 0.35
+
+@njit(cache=True, fastmath=True)
+def _contribution(j, v):
+    """SHAP contribution of feature j at value v: coefficient * value + bias"""
+    return SHAP_COEFFS[j] * v + SHAP_BIAS[j]
+
+@njit(cache=True, fastmath=True)
+def _probability(total):
+    """Clip the summed prediction into the displayed probability range"""
+    return max(0.01, min(0.99, total))
+
+@njit('Tuple((f4, f4, f4[:]))(f4[:])', cache=True, fastmath=True)
+def score(x):
+    """SHAP values of one sample; returns (base value, clipped probability, SHAP values)"""
+    out = np.empty(x.shape[0], dtype=np.float32)
+    total = SHAP_BASE_VALUE
+    for i in range(x.shape[0]):
+        out[i] = _contribution(i, x[i])
+        total += out[i]
+    return SHAP_BASE_VALUE, _probability(total), out
+
+# Rows are scored in parallel across cores by numba's threading layer
+@njit('Tuple((f4[:, :], f4[:]))(f4[:, :])', parallel=True, cache=True, fastmath=True)
+def score_batch(X):
+    """SHAP values and clipped probabilities for a 2-D array with one sample per row"""
+    out = np.empty((X.shape[0], X.shape[1]), dtype=np.float32)
+    probabilities = np.empty(X.shape[0], dtype=np.float32)
+    for i in prange(X.shape[0]):
+        total = SHAP_BASE_VALUE
+        for j in range(X.shape[1]):
+            out[i, j] = _contribution(j, X[i, j])
+            total += out[i, j]
+        probabilities[i] = _probability(total)
+    return out, probabilities
+
+# Serialises calls into score_batch across Streamlit session threads:
+# numba's default workqueue threading layer aborts the process on concurrent use
+_batch_lock = threading.Lock()
+
+def calculate_shap_values(sample):
+    """Calculate SHAP values for a sample array ordered as app.FEATURE_ORDER"""
+    
+    sample = np.asarray(sample, dtype=np.float32)
+    # The kernel does no bounds checks, so reject samples that do not match SHAP_COEFFS
+    if sample.shape != SHAP_COEFFS.shape:
+        raise ValueError(f"Expected a sample of shape {SHAP_COEFFS.shape}, got shape {sample.shape}")
+    
+    return score(sample)
+
+def calculate_shap_values_batch(samples):
+    """Calculate SHAP values for a 2-D array with one sample per row, columns ordered as app.FEATURE_ORDER"""
+    
+    samples = np.asarray(samples, dtype=np.float32)
+    # The kernel does no bounds checks, so reject rows that do not match SHAP_COEFFS
+    if samples.ndim != 2 or samples.shape[1] != SHAP_COEFFS.shape[0]:
+        raise ValueError(f"Expected a 2-D array with {SHAP_COEFFS.shape[0]} columns, got shape {samples.shape}")
+    
+    with _batch_lock:
+        shap_values, current_values = score_batch(samples)
+    
+    return SHAP_BASE_VALUE, current_values, shap_values
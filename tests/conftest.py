@@ -0,0 +1,5 @@
+import os
+import sys
+
+# app.py imports shap_kernels as a sibling module, as `streamlit run` puts the script directory on sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import shap_kernels
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+N_FEATURES = len(shap_kernels.SHAP_COEFFS)
+
+
+def test_app_loads_and_predicts():
+    """The page renders without errors and Predict shows a result for the default inputs"""
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+    assert not at.exception
+    assert len(at.slider) == 4 and len(at.selectbox) == 7
+
+    at.button[0].click().run()
+    assert not at.exception
+    markdown = [m.value for m in at.markdown]
+    assert any('The probability of patient frailty is **35.1%**' in m for m in markdown)
+    assert any('data:image/png;base64,' in m for m in markdown)
+
+
+def test_batch_matches_single_sample():
+    """Each row of the batch kernel agrees with the single-sample kernel"""
+    samples = np.array([[0, 0, 0, 0.0, 0, 120.0, 0, 0, 40, 18.5, 0],
+                        [1, 2, 1, 12.5, 2, 95.0, 1, 1, 82, 31.2, 1]], dtype=np.float32)
+    base_value, current_values, shap_values = shap_kernels.calculate_shap_values_batch(samples)
+
+    for row, current, shap in zip(samples, current_values, shap_values):
+        single_base, single_current, single_shap = shap_kernels.calculate_shap_values(row)
+        assert base_value == pytest.approx(single_base)
+        assert current == pytest.approx(single_current, abs=1e-6)
+        np.testing.assert_allclose(shap, single_shap, atol=1e-6)
+
+
+def test_batch_rejects_wrong_width():
+    """Rows wider than SHAP_COEFFS would read past the coefficient arrays"""
+    with pytest.raises(ValueError):
+        shap_kernels.calculate_shap_values_batch(np.zeros((3, N_FEATURES + 1), dtype=np.float32))
+
+
+def test_single_rejects_wrong_length():
+    """A sample longer than SHAP_COEFFS would read past the coefficient arrays"""
+    with pytest.raises(ValueError):
+        shap_kernels.calculate_shap_values(np.zeros(N_FEATURES + 1, dtype=np.float32))